@@ -3,44 +3,109 @@ import glob
 import sys
 import re
 import argparse
+import filecmp
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 
-def compare_dirs(dir1_pattern, dir2_pattern):
-    # Resolve globs to find actual build out dirs (cargo adds random hashes)
-    candidates1 = glob.glob(dir1_pattern)
-    candidates2 = glob.glob(dir2_pattern)
-    
-    if not candidates1:
-        print(f"Error: No directory found matching {dir1_pattern}")
-        sys.exit(1)
-    if not candidates2:
-        print(f"Error: No directory found matching {dir2_pattern}")
+# File reads are I/O-bound, so oversubscribe the CPU count
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+BLOCK_SIZE = 8192
+# One pass over a file sees scope braces and `let mut` bindings in source order
+SCAN_RE = re.compile(rb"([{}])|\blet\s+mut\s+([A-Za-z_][A-Za-z0-9_]*)\b")
+
+def _scan_ext(root, ext):
+    """Yield a DirEntry for every file under `root` ending in `ext`.
+
+    Walks with os.scandir so directory checks come from the dirent and
+    `entry.stat()` is cached. Like `glob("**")`, hidden entries are skipped and
+    unreadable directories are ignored; directory symlinks are not followed.
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(ext):
+                    yield entry
+
+def _resolve_dir(pattern):
+    candidates = glob.glob(pattern)
+    if not candidates:
+        print(f"Error: No directory found matching {pattern}")
         sys.exit(1)
-        
-    # Pick the most recent ones if multiple exist
-    dir1 = max(candidates1, key=os.path.getmtime)
-    dir2 = max(candidates2, key=os.path.getmtime)
+    return max(candidates, key=os.path.getmtime)
+
+def _normalized_blocks(path):
+    """Yield the file with ASCII whitespace runs collapsed to one space, block by block.
+
+    Like `" ".join(data.split())` on bytes, without holding the whole file in memory.
+    Unicode whitespace such as U+00A0 is kept as-is, unlike `str.split()`.
+    Pieces vary in length and are never empty.
+    """
+    started = gap = False
+    # Unbuffered: every read is a single os.read into a fresh bytes object, with no BufferedReader copy
+    with open(path, "rb", buffering=0) as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            # Whitespace at a block edge may continue in the next block, so it is carried over as a gap
+            lead = block[:1].isspace()
+            body = b" ".join(block.split())
+            if not body:
+                gap = gap or lead
+                continue
+            if started and (gap or lead):
+                yield b" "
+            yield body
+            started = True
+            gap = block[-1:].isspace()
+
+def _normalized_equal(f1, f2):
+    # The two streams are cut at different places, so compare their overlap and carry the rest
+    it1, it2 = _normalized_blocks(f1), _normalized_blocks(f2)
+    rest1 = rest2 = b""
+    while True:
+        rest1 = rest1 or next(it1, b"")
+        rest2 = rest2 or next(it2, b"")
+        if not rest1 or not rest2:
+            return not rest1 and not rest2
+        n = min(len(rest1), len(rest2))
+        if rest1[:n] != rest2[:n]:
+            return False
+        rest1, rest2 = rest1[n:], rest2[n:]
+
+def _same_output(f1, f2):
+    # Byte-identical files need no normalization (filecmp rejects on size, then compares blocks in C)
+    return filecmp.cmp(f1, f2, shallow=False) or _normalized_equal(f1, f2)
+
+def compare_dirs(dir1_pattern, dir2_pattern):
+    # Resolve globs to find actual build out dirs (cargo adds random hashes),
+    # picking the most recent ones if multiple exist
+    dir1 = _resolve_dir(dir1_pattern)
+    dir2 = _resolve_dir(dir2_pattern)
 
     print(f"Comparing:\n  A: {dir1}\n  B: {dir2}")
     
-    files1 = glob.glob(os.path.join(dir1, "**", "*.rs"), recursive=True)
-    diffs = []
+    rels1 = sorted(os.path.relpath(entry.path, dir1) for entry in _scan_ext(dir1, ".rs"))
+    rels2 = {os.path.relpath(entry.path, dir2) for entry in _scan_ext(dir2, ".rs")}
+    common = [rel for rel in rels1 if rel in rels2]
     
-    for f1 in files1:
-        rel = os.path.relpath(f1, dir1)
-        f2 = os.path.join(dir2, rel)
-        
-        if not os.path.exists(f2):
+    filecmp.clear_cache()
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+        same = dict(zip(common, pool.map(_same_output,
+                                         [os.path.join(dir1, rel) for rel in common],
+                                         [os.path.join(dir2, rel) for rel in common])))
+    
+    diffs = []
+    for rel in rels1:
+        if rel not in rels2:
             diffs.append(f"Missing in B: {rel}")
-            continue
-            
-        with open(f1, "r") as f: c1 = f.read()
-        with open(f2, "r") as f: c2 = f.read()
-        
-        # Normalize whitespace (strip and collapse multiple spaces/newlines to single space)
-        c1_norm = " ".join(c1.split())
-        c2_norm = " ".join(c2.split())
-        
-        if c1_norm != c2_norm:
+        elif not same[rel]:
             diffs.append(f"Content mismatch: {rel}")
 
     if diffs:
@@ -52,94 +117,101 @@ def compare_dirs(dir1_pattern, dir2_pattern):
         print("\n[SUCCESS] No differences found.")
 
 def check_shadowing(root_dir):
+    if not os.path.isdir(root_dir):
+        print(f"Error: No directory found at {root_dir}")
+        sys.exit(1)
     print(f"Checking for shadowed `let mut` declarations in {root_dir}...")
     shadowed = []
-    let_mut_re = re.compile(r"\blet\s+mut\s+([A-Za-z_][A-Za-z0-9_]*)\b")
-    for path in glob.glob(os.path.join(root_dir, "**", "*.rs"), recursive=True):
-        with open(path, "r") as f:
-            text = f.read()
-        scope_stack = [set()]
-        line_no = 1
-        for line in text.splitlines():
-            for ch in line:
-                if ch == "{":
-                    scope_stack.append(set())
-                elif ch == "}":
-                    if len(scope_stack) > 1:
-                        scope_stack.pop()
-            m = let_mut_re.search(line)
-            if m:
-                name = m.group(1)
-                if any(name in s for s in scope_stack[:-1]):
-                    shadowed.append((path, line_no, name))
-                scope_stack[-1].add(name)
-            line_no += 1
+    for entry in _scan_ext(root_dir, ".rs"):
+        # mmap refuses empty files, and there is nothing to scan in them anyway
+        if entry.stat().st_size == 0:
+            continue
+        path = entry.path
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                scope_stack = [set()]
+                # Line numbers advance from the previous report, so each byte is counted at most once
+                last_pos, line_no = 0, 1
+                for m in SCAN_RE.finditer(data):
+                    brace = m.group(1)
+                    if brace == b"{":
+                        scope_stack.append(set())
+                    elif brace == b"}":
+                        if len(scope_stack) > 1:
+                            scope_stack.pop()
+                    else:
+                        name = m.group(2).decode()
+                        if any(name in s for s in scope_stack[:-1]):
+                            # Only pay for line counting when there is something to report
+                            line_no += data[last_pos:m.start()].count(b"\n")
+                            last_pos = m.start()
+                            shadowed.append((path, line_no, name))
+                        scope_stack[-1].add(name)
     if not shadowed:
         print("  No shadowed `let mut` found.")
         return
     for path, line_no, name in shadowed:
         print(f"  Shadowed: {path}:{line_no} -> {name}")
 
+def _check_differ(differ, cmd):
+    # Both differs exit 0 for no differences, 1 for differences, anything else on trouble
+    if differ.wait() not in (0, 1):
+        print(f"Error: {cmd[0]} failed with exit code {differ.returncode}")
+        sys.exit(1)
+
 def show_diff(dir1_pattern, dir2_pattern):
     """Show actual content differences between stage outputs."""
-    import difflib
+    import shutil
     import subprocess
-    import tempfile
     
     # Resolve globs to find actual build out dirs
-    candidates1 = glob.glob(dir1_pattern)
-    candidates2 = glob.glob(dir2_pattern)
-    
-    if not candidates1:
-        print(f"Error: No directory found matching {dir1_pattern}")
-        sys.exit(1)
-    if not candidates2:
-        print(f"Error: No directory found matching {dir2_pattern}")
-        sys.exit(1)
-        
-    dir1 = max(candidates1, key=os.path.getmtime)
-    dir2 = max(candidates2, key=os.path.getmtime)
+    dir1 = _resolve_dir(dir1_pattern)
+    dir2 = _resolve_dir(dir2_pattern)
 
     print(f"Comparing:\n  Stage 1: {dir1}\n  Stage 2: {dir2}\n")
+    sys.stdout.flush()
     
-    files1 = glob.glob(os.path.join(dir1, "**", "*.rs"), recursive=True)
-    all_diffs = []
-    
-    for f1 in files1:
-        rel = os.path.relpath(f1, dir1)
-        f2 = os.path.join(dir2, rel)
-        
-        if not os.path.exists(f2):
-            all_diffs.append(f"=== Missing in Stage 2: {rel} ===\n")
+    # Let a native differ walk both trees; prefer git, fall back to plain diff
+    differs = [
+        # No rename detection: a file missing from Stage 2 must show up as a deletion.
+        # No external diff driver: the user's diff.external must not replace the output.
+        ["git", "--no-pager", "diff", "--no-index", "--no-color", "--no-renames", "--no-ext-diff",
+         "--", dir1, dir2],
+        ["diff", "-ruN", dir1, dir2],
+    ]
+    for cmd in differs:
+        try:
+            differ = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            break
+        except FileNotFoundError:
             continue
-            
-        with open(f1, "r") as f: c1 = f.readlines()
-        with open(f2, "r") as f: c2 = f.readlines()
-        
-        diff = list(difflib.unified_diff(c1, c2, 
-                                          fromfile=f"Stage1/{rel}", 
-                                          tofile=f"Stage2/{rel}",
-                                          lineterm=""))
-        if diff:
-            all_diffs.append("\n".join(diff) + "\n")
-    
-    if not all_diffs:
-        print("[SUCCESS] No differences found between Stage 1 and Stage 2.")
-        return
-    
-    # Write to temp file and open with pager
-    combined = "\n".join(all_diffs)
+    else:
+        print("Error: Neither git nor diff is available")
+        sys.exit(1)
     
-    # Try to use less with color support, fall back to cat
-    try:
-        pager = os.environ.get("PAGER", "less -R")
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".diff", delete=False) as tmp:
-            tmp.write(combined)
-            tmp_path = tmp.name
-        subprocess.run(f"{pager} {tmp_path}", shell=True)
-        os.unlink(tmp_path)
-    except Exception:
-        print(combined)
+    with differ.stdout:
+        first = differ.stdout.read(BLOCK_SIZE)
+        if not first:
+            _check_differ(differ, cmd)
+            print("[SUCCESS] No differences found between Stage 1 and Stage 2.")
+            return
+        
+        # Stream the diff straight into the pager rather than collecting it first
+        pager = subprocess.Popen(os.environ.get("PAGER", "less -R"), shell=True, stdin=subprocess.PIPE)
+        killed = False
+        try:
+            with pager.stdin:
+                pager.stdin.write(first)
+                shutil.copyfileobj(differ.stdout, pager.stdin)
+        except BrokenPipeError:
+            # The pager was closed before reading everything
+            differ.kill()
+            killed = True
+    pager.wait()
+    if killed:
+        differ.wait()
+    else:
+        _check_differ(differ, cmd)
 
 def main():
     parser = argparse.ArgumentParser(description="Verification utility")